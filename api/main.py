@@ -1,11 +1,21 @@
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import io
+import sys
+from typing import Any, Dict, List, Optional
 
-from services.parser import parse_reviews_file
-from services.llm_client import analyze_reviews_with_llm
-from services.report_pdf import build_pdf
+import msgspec
+
+from services.cache import content_hasher, report_key, get_report, set_report
+from services.schema import Report
+
+# services.parser (pandas), services.llm_client and services.report_pdf (reportlab)
+# are imported lazily so a cold worker can answer /health before loading them
+
+_CHUNK_SIZE = 1024 * 1024
 
 app = FastAPI(
     title="Hotel Review Analyzer API",
@@ -22,28 +32,110 @@ app.add_middleware(
 )
 
 
+_preload_task: Optional[asyncio.Future] = None
+
+
+def _preload_services():
+    import services.parser  # noqa: F401
+    import services.llm_client  # noqa: F401
+    import services.report_pdf  # noqa: F401
+
+
+def _preload_error() -> Optional[BaseException]:
+    """The exception the preload failed with, if it has finished and failed."""
+    if _preload_task is None or not _preload_task.done() or _preload_task.cancelled():
+        return None
+    return _preload_task.exception()
+
+
+async def _services_ready():
+    """Wait until the heavy modules are imported in a worker thread.
+
+    Importing them on the event-loop thread while the preload is midway would block
+    on the import lock and stall every request, /health included.
+    Raises 503 if the modules can't be imported (e.g. a missing dependency).
+    """
+    global _preload_task
+    if _preload_task is None or _preload_task.get_loop() is not asyncio.get_running_loop():
+        _preload_task = asyncio.ensure_future(asyncio.to_thread(_preload_services))
+    try:
+        await asyncio.shield(_preload_task)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Сервис недоступен: {e}")
+
+
+@app.on_event("startup")
+async def startup():
+    """Load heavy modules in the background so the first analysis doesn't pay for it."""
+    global _preload_task
+    _preload_task = asyncio.ensure_future(asyncio.to_thread(_preload_services))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the LLM HTTP client, if the client module was ever loaded."""
+    # Don't wait for (or re-raise) the preload: there's nothing to close unless it got this far
+    llm_client = sys.modules.get("services.llm_client")
+    close_client = getattr(llm_client, "close_client", None)
+    if close_client is not None:
+        await close_client()
+
+
 @app.get("/health")
-def health():
-    """Health check endpoint."""
+async def health():
+    """Health check endpoint; unhealthy once the service modules have failed to load."""
+    error = _preload_error()
+    if error is not None:
+        return JSONResponse(
+            status_code=503,
+            content={"ok": False, "status": "unavailable", "detail": str(error)},
+        )
     return {"ok": True, "status": "healthy"}
 
 
-@app.post("/analyze")
-async def analyze(
-    file: UploadFile = File(..., description="Файл с отзывами (xlsx, csv, txt)"),
-    custom_prompt: str = Form("", description="Собственный промпт (необязательно)"),
-    max_reviews: int = Form(200, description="Максимум отзывов для анализа"),
-):
-    """
-    Анализ отзывов отеля.
+async def _hash_upload(file: UploadFile) -> str:
+    """Hash the upload chunk by chunk, then rewind it for parsing."""
+    hasher = content_hasher()
+    while chunk := await file.read(_CHUNK_SIZE):
+        hasher.update(chunk)
+    await file.seek(0)
+    return hasher.hexdigest()
+
+
+def _json_response(data: Any) -> Response:
+    # FastAPI's encoder doesn't know msgspec Structs; msgspec encodes them directly
+    return Response(msgspec.json.encode(data), media_type="application/json")
+
+
+async def _analyze_cached(key: str, reviews: List[Dict], custom_prompt: str) -> Report:
+    """Run LLM analysis, reusing a cached report for identical uploads."""
+    report = get_report(key)
+    if report is not None:
+        return report
+
+    await _services_ready()
+    from services.llm_client import analyze_reviews_with_llm
+
+    try:
+        report = await analyze_reviews_with_llm(
+            reviews=reviews,
+            custom_prompt=custom_prompt,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
+
+    set_report(key, report)
+    return report
+
+
+async def _analyze_upload(file: UploadFile, custom_prompt: str, max_reviews: int) -> Dict:
+    """Parse an uploaded file and analyze its reviews."""
+    await _services_ready()
+    from services.parser import parse_reviews_file
 
-    - **file**: Файл с отзывами (Excel, CSV или TXT)
-    - **custom_prompt**: Собственный промпт для анализа (необязательно)
-    - **max_reviews**: Максимальное количество отзывов для обработки
-    """
     try:
-        content = await file.read()
-        reviews = parse_reviews_file(filename=file.filename or "", content=content)
+        digest = await _hash_upload(file)
+        reviews = await run_in_threadpool(parse_reviews_file, file.filename or "", file.file)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -55,13 +147,8 @@ async def analyze(
     # Limit reviews
     reviews_limited = reviews[:max_reviews]
 
-    try:
-        report = analyze_reviews_with_llm(
-            reviews=reviews_limited,
-            custom_prompt=custom_prompt,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
+    key = report_key(digest, file.filename or "", custom_prompt, max_reviews)
+    report = await _analyze_cached(key, reviews_limited, custom_prompt)
 
     return {
         "report": report,
@@ -70,6 +157,45 @@ async def analyze(
     }
 
 
+@app.post("/analyze")
+async def analyze(
+    file: UploadFile = File(..., description="Файл с отзывами (xlsx, csv, txt)"),
+    custom_prompt: str = Form("", description="Собственный промпт (необязательно)"),
+    max_reviews: int = Form(200, description="Максимум отзывов для анализа"),
+):
+    """
+    Анализ отзывов отеля.
+
+    - **file**: Файл с отзывами (Excel, CSV или TXT)
+    - **custom_prompt**: Собственный промпт для анализа (необязательно)
+    - **max_reviews**: Максимальное количество отзывов для обработки
+    """
+    return _json_response(await _analyze_upload(file, custom_prompt, max_reviews))
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(..., description="Файлы с отзывами (xlsx, csv, txt)"),
+    custom_prompt: str = Form("", description="Собственный промпт (необязательно)"),
+    max_reviews: int = Form(200, description="Максимум отзывов для анализа в каждом файле"),
+):
+    """
+    Параллельный анализ нескольких файлов с отзывами.
+
+    Возвращает результат для каждого файла в исходном порядке; ошибка в одном
+    файле не прерывает обработку остальных.
+    """
+    async def _one(file: UploadFile) -> Dict:
+        try:
+            result = await _analyze_upload(file, custom_prompt, max_reviews)
+        except HTTPException as e:
+            return {"filename": file.filename, "error": e.detail}
+        return {"filename": file.filename, **result}
+
+    results = await asyncio.gather(*[_one(f) for f in files])
+    return _json_response({"results": results})
+
+
 @app.post("/analyze/pdf")
 async def analyze_pdf(
     file: UploadFile = File(..., description="Файл с отзывами"),
@@ -79,24 +205,10 @@ async def analyze_pdf(
     """
     Анализ отзывов с возвратом PDF-отчета.
     """
-    try:
-        content = await file.read()
-        reviews = parse_reviews_file(filename=file.filename or "", content=content)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Ошибка чтения файла: {str(e)}")
-
-    if not reviews:
-        raise HTTPException(status_code=400, detail="Не удалось найти отзывы в файле")
+    report = (await _analyze_upload(file, custom_prompt, max_reviews))["report"]
 
-    reviews_limited = reviews[:max_reviews]
-
-    try:
-        report = analyze_reviews_with_llm(
-            reviews=reviews_limited,
-            custom_prompt=custom_prompt,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка анализа: {str(e)}")
+    await _services_ready()
+    from services.report_pdf import build_pdf
 
     try:
         pdf_bytes = build_pdf(report, title="Отчет по анализу отзывов")
@@ -108,3 +220,10 @@ async def analyze_pdf(
         media_type="application/pdf",
         headers={"Content-Disposition": "attachment; filename=hotel_reviews_report.pdf"}
     )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # "auto" picks uvloop where uvicorn[standard] installed it and asyncio elsewhere (Windows)
+    uvicorn.run("api.main:app", host="0.0.0.0", port=8000, loop="auto")
@@ -5,17 +5,32 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(PROJECT_ROOT))
 
+import asyncio
 import os
 import streamlit as st
 # In Docker we pass env vars via docker-compose env_file
 # Locally, .env can be loaded by python-dotenv if you want, but not required.
 
 
+from services.cache import content_hash, report_key, get_report, set_report
 from services.parser import parse_reviews_file
-from services.llm_client import analyze_reviews_with_llm
+from services.llm_client import analyze_reviews_with_llm, close_client
 from services.report_pdf import build_pdf
 
 
+@st.cache_data(hash_funcs={bytes: content_hash}, show_spinner=False)
+def _parse_file(filename, content):
+    return parse_reviews_file(filename, content)
+
+
+async def _run_analysis(reviews, custom_prompt):
+    # Each Streamlit rerun gets its own event loop; close that loop's client when done
+    try:
+        return await analyze_reviews_with_llm(reviews=reviews, custom_prompt=custom_prompt)
+    finally:
+        await close_client()
+
+
 st.set_page_config(
     page_title="Анализатор отзывов отеля",
     page_icon="🏨",
@@ -60,7 +75,7 @@ if run:
     # Parse file
     with st.spinner("📖 Читаем файл..."):
         try:
-            reviews = parse_reviews_file(uploaded.name, uploaded.getvalue())
+            reviews = _parse_file(uploaded.name, uploaded.getvalue())
         except Exception as e:
             st.error(f"❌ Ошибка при чтении файла: {str(e)}")
             st.stop()
@@ -79,10 +94,16 @@ if run:
     # Send to LLM
     with st.spinner("🤖 Отправляем в Gemini для анализа... (это может занять минуту)"):
         try:
-            report = analyze_reviews_with_llm(
-                reviews=reviews_for_llm,
-                custom_prompt=custom_prompt if custom_prompt else ""
+            cache_key = report_key(
+                content_hash(uploaded.getvalue()), uploaded.name, custom_prompt or "", max_reviews
             )
+            report = get_report(cache_key)
+            if report is None:
+                report = asyncio.run(_run_analysis(
+                    reviews=reviews_for_llm,
+                    custom_prompt=custom_prompt if custom_prompt else ""
+                ))
+                set_report(cache_key, report)
         except Exception as e:
             st.error(f"❌ Ошибка API: {str(e)}")
             st.stop()
@@ -94,33 +115,33 @@ if run:
 
     # Executive Summary
     st.subheader("📋 Краткое резюме")
-    summary = report.get("executive_summary", "")
+    summary = report.executive_summary
     if summary:
         st.write(summary)
-    elif "raw_output" in report:
+    elif report.raw_output is not None:
         st.warning("⚠️ Модель вернула нестандартный формат. Проверьте PDF для полных данных.")
         with st.expander("Показать сырой вывод"):
-            st.text(str(report.get("raw_output", ""))[:2000])
+            st.text(report.raw_output[:2000])
 
     # Key findings in columns
     col1, col2 = st.columns(2)
 
     with col1:
-        positives = report.get("positives", [])
+        positives = report.positives
         if positives:
             st.subheader("✅ Плюсы")
             for p in positives[:5]:
                 st.write(f"• {p}")
 
     with col2:
-        negatives = report.get("negatives", [])
+        negatives = report.negatives
         if negatives:
             st.subheader("❌ Минусы")
             for n in negatives[:5]:
                 st.write(f"• {n}")
 
     # Risk flags
-    risk_flags = report.get("risk_flags", [])
+    risk_flags = report.risk_flags
     if risk_flags and risk_flags != ["Критических проблем не выявлено"]:
         st.subheader("🚨 Красные флаги")
         for flag in risk_flags:
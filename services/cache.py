@@ -0,0 +1,66 @@
+import os
+from typing import Optional
+
+import blake3
+import diskcache
+import msgspec
+
+from services.schema import Report
+
+
+_cache = diskcache.Cache(
+    os.environ.get("LLM_CACHE_DIR", "/tmp/llm_cache"),
+    eviction_policy="least-recently-used",
+)
+
+
+_REPORT_DECODER = msgspec.json.Decoder(Report)
+
+
+def content_hash(content: bytes) -> str:
+    """Hash uploaded file content."""
+    return blake3.blake3(content).hexdigest()
+
+
+def content_hasher() -> blake3.blake3:
+    """Incremental hasher for content read in chunks; matches content_hash()."""
+    return blake3.blake3()
+
+
+def report_key(content_digest: str, filename: str, custom_prompt: str, max_reviews: int) -> str:
+    """Build a cache key for an analysis of the given file with the current LLM settings."""
+    # The same bytes parse differently as CSV and TXT, so the file type is part of the key
+    file_type = os.path.splitext(filename or "")[1].lower()
+    provider = os.environ.get("LLM_PROVIDER", "openai").lower()
+    if provider == "gemini":
+        model = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
+    else:
+        model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+
+    # Sharding and the reduce step change the merged report, so they're part of the key
+    shard_size = os.environ.get("LLM_SHARD_SIZE", "40")
+    reduce_summary = os.environ.get("LLM_REDUCE_SUMMARY", "1").lower() in ("1", "true", "yes")
+
+    parts = [
+        content_digest, file_type, provider, model, str(max_reviews), shard_size, str(reduce_summary),
+        custom_prompt.strip(),
+    ]
+    return blake3.blake3("\x00".join(parts).encode("utf-8")).hexdigest()
+
+
+def get_report(key: str) -> Optional[Report]:
+    data = _cache.get(key)
+    if not isinstance(data, bytes):
+        return None
+    try:
+        return _REPORT_DECODER.decode(data)
+    except msgspec.DecodeError:
+        return None
+
+
+def set_report(key: str, report: Report) -> None:
+    # Don't cache failed or degraded (truncated, partially merged) analyses,
+    # so a retry actually calls the LLM again
+    if report.failed or report.warning:
+        return
+    _cache.set(key, msgspec.json.encode(report))
@@ -1,31 +1,216 @@
 import os
-import json
-from typing import List, Dict
+import re
+import asyncio
+import weakref
+from collections import Counter
+from itertools import zip_longest
+from functools import lru_cache
+from typing import Any, List, Dict, Optional, Tuple
+
+import httpx
+import msgspec
+import orjson
+import partial_json_parser as partial_json
+from partial_json_parser import Allow
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+from services.prompt import BASE_PROMPT, JSON_SCHEMA_INSTRUCTION, SUMMARY_REDUCE_PROMPT, NO_RISKS
+from services.schema import Quotes, Report
+
+_LIST_FIELDS = ("positives", "negatives", "risk_flags", "action_plan", "best_practices")
+_MAX_LIST_ITEMS = 10
+_MAX_QUOTES = 3
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_REPORT_DECODER = msgspec.json.Decoder(Report)
+# Report fields (JSON names) that we set ourselves; the model must not be able to set them
+_DIAGNOSTIC_KEYS = ("raw_output", "parse_error", "error", "finish_reason", "_warning")
+_ERROR_FIELD_RE = re.compile(r"at `\$\.([^.`\[]+)")
+_FENCE_RE = re.compile(r"^```[\w-]*[ \t]*\n(.*?)(?:\n[ \t]*```|\Z)", re.S)
+
+
+class _LoopState:
+    """HTTP client and LLM concurrency limit belonging to one event loop."""
+
+    def __init__(self):
+        self.client = _new_client()
+        # Bounds in-flight LLM calls (shards and batch files alike) to respect provider rate limits
+        self.semaphore = asyncio.Semaphore(int(os.environ.get("LLM_CONCURRENCY", "8")))
+
+
+# httpx connections and asyncio semaphores are bound to the loop that first uses them,
+# and Streamlit runs a separate asyncio.run loop in each session thread
+_loop_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        timeout=300,
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=60),
+    )
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _loop_states.get(loop)
+    if state is None or state.client.is_closed:
+        state = _loop_states[loop] = _LoopState()
+    return state
+
+
+async def close_client() -> None:
+    """Close the current event loop's HTTP client (call before the loop shuts down)."""
+    state = _loop_states.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        await state.client.aclose()
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRY_STATUSES
+    return isinstance(exc, (httpx.ConnectError, httpx.RemoteProtocolError))
 
-import requests
 
-from services.prompt import BASE_PROMPT, JSON_SCHEMA_INSTRUCTION
+@retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential(multiplier=1, max=30),
+    stop=stop_after_attempt(4),
+    reraise=True,
+)
+async def _post(url: str, payload: Dict, headers: Dict, timeout: float) -> httpx.Response:
+    """POST JSON to the LLM API, retrying with backoff on rate limits and server errors."""
+    state = _loop_state()
+    async with state.semaphore:
+        resp = await state.client.post(url, headers=headers, content=orjson.dumps(payload), timeout=timeout)
+    if resp.status_code in _RETRY_STATUSES:
+        resp.raise_for_status()
+    return resp
 
 
-def analyze_reviews_with_llm(reviews: List[Dict], custom_prompt: str = "") -> Dict:
+async def analyze_reviews_with_llm(reviews: List[Dict], custom_prompt: str = "") -> Report:
     provider = os.environ.get("LLM_PROVIDER", "openai").lower()
 
+    if provider == "openai":
+        analyze = _analyze_openai
+    elif provider == "gemini":
+        analyze = _analyze_gemini
+    else:
+        raise ValueError("LLM_PROVIDER must be 'openai' or 'gemini'")
+
     prompt = BASE_PROMPT
     if custom_prompt.strip():
         prompt = custom_prompt.strip()
 
-    joined_reviews = "\n".join([f"- {r.get('review_text','')}" for r in reviews if r.get("review_text")])
+    shards = _shard(reviews, int(os.environ.get("LLM_SHARD_SIZE", "40")))
+    if len(shards) <= 1:
+        return await analyze(prompt=prompt, reviews_text=_join(reviews))
+
+    # Analyze shards concurrently: wall time is roughly one shard's latency
+    tasks = [asyncio.ensure_future(analyze(prompt=prompt, reviews_text=_join(s))) for s in shards]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # gather doesn't cancel siblings on failure; stop them spending tokens
+        for task in tasks:
+            task.cancel()
+        raise
+    report = _merge_reports(list(results))
+
+    # Reduce step: one shard's summary describes only part of the reviews, so let the model
+    # combine them (LLM_REDUCE_SUMMARY=0 skips the extra call and keeps the first one)
+    if os.environ.get("LLM_REDUCE_SUMMARY", "1").lower() in ("1", "true", "yes"):
+        summaries = [r.executive_summary for r in results if not r.failed and r.executive_summary]
+        if len(summaries) > 1:
+            reduced = await analyze(
+                prompt=SUMMARY_REDUCE_PROMPT,
+                reviews_text="\n".join(f"- {s}" for s in summaries),
+            )
+            if not reduced.failed and reduced.executive_summary:
+                report.executive_summary = reduced.executive_summary
+            else:
+                note = "Summary covers only part of the reviews (combining shard summaries failed)"
+                report.warning = f"{report.warning}; {note}" if report.warning else note
+
+    return report
+
+
+def _shard(reviews: List[Dict], n: int = 40) -> List[List[Dict]]:
+    """Split reviews into chunks of at most n items."""
+    n = max(n, 1)
+    return [reviews[i:i + n] for i in range(0, len(reviews), n)]
+
+
+def _join(reviews: List[Dict]) -> str:
+    # parse_reviews_file only emits non-empty review_text, so no filtering is needed here
+    return "\n".join(f"- {r['review_text']}" for r in reviews)
+
+
+def _round_robin(lists: List[List[str]]) -> List[str]:
+    """Interleave lists (a[0], b[0], ..., a[1], b[1], ...) so no shard is favoured by position."""
+    return [
+        item
+        for group in zip_longest(*lists, fillvalue=None)
+        for item in group
+        if item is not None
+    ]
+
+
+def _rank(lists: List[List[str]], limit: Optional[int] = None, exclude: Tuple[str, ...] = ()) -> List[str]:
+    """Deduplicate items across shards, most frequent first, ties in round-robin order."""
+    counts = Counter(
+        item.strip()
+        for item in _round_robin(lists)
+        if item.strip() and item.strip() not in exclude
+    )
+    return [item for item, _ in counts.most_common(limit)]
 
-    if provider == "openai":
-        return _analyze_openai(prompt=prompt, reviews_text=joined_reviews)
 
-    if provider == "gemini":
-        return _analyze_gemini(prompt=prompt, reviews_text=joined_reviews)
+def _merge_reports(results: List[Report]) -> Report:
+    """Merge partial reports from review shards into a single report."""
+    parsed = [r for r in results if not r.failed]
+    if not parsed:
+        return results[0]
 
-    raise ValueError("LLM_PROVIDER must be 'openai' or 'gemini'")
+    # One shard's summary keeps the schema's 2-3 sentences; the reduce step combines them
+    merged = Report(
+        executive_summary=next((r.executive_summary.strip() for r in parsed if r.executive_summary), ""),
+    )
 
+    # Items repeated across shards are the most frequent themes, so rank them first
+    for field in _LIST_FIELDS:
+        if field == "risk_flags":
+            continue
+        setattr(merged, field, _rank([getattr(r, field) for r in parsed], limit=_MAX_LIST_ITEMS))
 
-def _analyze_openai(prompt: str, reviews_text: str) -> Dict:
+    # Legacy fields: build_pdf falls back to actionable_recommendations for the action plan
+    merged.actionable_recommendations = _rank(
+        [r.actionable_recommendations for r in parsed], limit=_MAX_LIST_ITEMS
+    )
+    key_themes = [r.key_themes for r in parsed if r.key_themes is not None]
+    if key_themes:
+        merged.key_themes = _rank(key_themes, limit=_MAX_LIST_ITEMS)
+
+    # Never truncate risk flags: dropping one from a later shard would hide a real problem
+    merged.risk_flags = _rank([r.risk_flags for r in parsed], exclude=(NO_RISKS,)) or [NO_RISKS]
+
+    quotes = [r.quotes for r in parsed]
+    merged.quotes = Quotes(
+        wow_effect=next((q.wow_effect for q in quotes if q.wow_effect), ""),
+        typical_positive=next((q.typical_positive for q in quotes if q.typical_positive), ""),
+        typical_negatives=_rank([q.typical_negatives for q in quotes], limit=_MAX_QUOTES),
+    )
+
+    warnings = [r.warning for r in parsed if r.warning]
+    failed = len(results) - len(parsed)
+    if failed:
+        warnings.append(f"{failed} of {len(results)} review shards could not be parsed")
+    if warnings:
+        merged.warning = "; ".join(warnings)
+
+    return merged
+
+
+async def _analyze_openai(prompt: str, reviews_text: str) -> Report:
     api_key = os.environ.get("OPENAI_API_KEY", "")
     base_url = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
     model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
@@ -46,25 +231,45 @@ def _analyze_openai(prompt: str, reviews_text: str) -> Dict:
         ],
     }
 
-    resp = requests.post(url, headers=headers, json=payload, timeout=180)
+    resp = await _post(url, payload, headers, timeout=180)
     resp.raise_for_status()
 
-    content = resp.json()["choices"][0]["message"]["content"]
+    content = orjson.loads(resp.content)["choices"][0]["message"]["content"]
     return _safe_json(content)
 
 
-def _analyze_gemini(prompt: str, reviews_text: str) -> dict:
+@lru_cache(maxsize=16)
+def _gemini_endpoint(model: str, api_key: str) -> str:
+    return (
+        f"https://generativelanguage.googleapis.com/v1beta/models/"
+        f"{model}:generateContent"
+        f"?key={api_key}"
+    )
+
+
+@lru_cache(maxsize=16)
+def _gemini_gen_config(model: str) -> Tuple[Tuple[str, Any], ...]:
+    """Generation config for the model, frozen as items so the cached value can't be mutated."""
+    gen_config = {
+        "temperature": 0.2,
+        "maxOutputTokens": 16384,
+    }
+
+    # Try to use JSON mode for supported models
+    if "1.5" in model or "2.0" in model:
+        gen_config["responseMimeType"] = "application/json"
+
+    return tuple(gen_config.items())
+
+
+async def _analyze_gemini(prompt: str, reviews_text: str) -> Report:
     api_key = os.environ.get("GEMINI_API_KEY")
     model = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
 
     if not api_key:
         raise ValueError("Missing GEMINI_API_KEY")
 
-    url = (
-        f"https://generativelanguage.googleapis.com/v1beta/models/"
-        f"{model}:generateContent"
-        f"?key={api_key}"
-    )
+    url = _gemini_endpoint(model, api_key)
 
     # Build the full prompt - emphasize Russian output
     full_prompt = f"""{prompt}
@@ -79,15 +284,8 @@ def _analyze_gemini(prompt: str, reviews_text: str) -> dict:
 Проанализируй отзывы выше и верни JSON на РУССКОМ языке. Не обрезай ответ!
 """
 
-    # Build generation config based on model
-    gen_config = {
-        "temperature": 0.2,
-        "maxOutputTokens": 16384,
-    }
-
-    # Try to use JSON mode for supported models
-    if "1.5" in model or "2.0" in model:
-        gen_config["responseMimeType"] = "application/json"
+    # Fresh copy: the JSON-mode fallback below mutates it
+    gen_config = dict(_gemini_gen_config(model))
 
     payload = {
         "contents": [
@@ -99,17 +297,18 @@ def _analyze_gemini(prompt: str, reviews_text: str) -> dict:
         "generationConfig": gen_config,
     }
 
-    resp = requests.post(url, json=payload, timeout=300)
+    headers = {"Content-Type": "application/json"}
+    resp = await _post(url, payload, headers, timeout=300)
 
     # If JSON mode fails, retry without it
     if resp.status_code == 400 and "responseMimeType" in gen_config:
         del gen_config["responseMimeType"]
         payload["generationConfig"] = gen_config
-        resp = requests.post(url, json=payload, timeout=300)
+        resp = await _post(url, payload, headers, timeout=300)
 
     resp.raise_for_status()
 
-    data = resp.json()
+    data = orjson.loads(resp.content)
 
     # Check for finish reason
     finish_reason = None
@@ -122,106 +321,92 @@ def _analyze_gemini(prompt: str, reviews_text: str) -> dict:
     try:
         text = data["candidates"][0]["content"]["parts"][0]["text"]
     except (KeyError, IndexError):
-        return {
-            "raw_output": str(data),
-            "error": "Could not extract text from Gemini response",
-            "finish_reason": finish_reason
-        }
+        return Report(
+            raw_output=str(data),
+            error="Could not extract text from Gemini response",
+            finish_reason=finish_reason,
+        )
 
     result = _safe_json(text)
 
     # Add warning if truncated
     if finish_reason and finish_reason not in ["STOP", "END_TURN", "FINISH"]:
-        result["_warning"] = f"Response may be incomplete (finishReason: {finish_reason})"
+        result.warning = f"Response may be incomplete (finishReason: {finish_reason})"
 
     return result
 
 
-def _safe_json(text: str) -> Dict:
+def _safe_json(text: str) -> Report:
     text = text.strip()
 
-    # Remove markdown code block wrapper if present
-    if text.startswith("```"):
-        lines = text.split("\n")
-        json_lines = []
-        in_json = False
-        for line in lines:
-            stripped = line.strip()
-            if stripped.startswith("```") and not in_json:
-                in_json = True
-                continue
-            elif stripped == "```":
-                break
-            elif in_json:
-                json_lines.append(line)
-        text = "\n".join(json_lines)
-
-    # Try to parse JSON
+    # Remove markdown code block wrapper if present (closing fence may be cut off)
+    match = _FENCE_RE.match(text)
+    if match:
+        text = match.group(1)
+
+    # Try to parse JSON straight into the report schema
     try:
-        return json.loads(text)
-    except json.JSONDecodeError as e:
-        # Try to fix truncated JSON
-        fixed_text = _try_fix_json(text)
-        if fixed_text:
-            try:
-                return json.loads(fixed_text)
-            except json.JSONDecodeError:
-                pass
-
-        # Return raw with error info
-        return {
-            "raw_output": text,
-            "parse_error": str(e),
-            "error_position": e.pos if hasattr(e, 'pos') else None
-        }
-
-
-def _try_fix_json(text: str) -> str:
-    """Attempt to fix truncated or malformed JSON."""
-    if not text:
-        return None
+        report = _REPORT_DECODER.decode(text)
+        return msgspec.structs.replace(
+            report, raw_output=None, parse_error=None, error=None, finish_reason=None, warning=None
+        )
+    except msgspec.ValidationError:
+        # Valid JSON with an unexpected shape: coerce what we can
+        return _to_report(msgspec.json.decode(text), text)
+    except msgspec.DecodeError as e:
+        error = e
+
+    # Truncated JSON: let the partial parser close open strings/containers
+    try:
+        return _to_report(partial_json.loads(text, Allow.ALL), text)
+    except Exception:
+        # The partial parser can fail with assertion/index errors on malformed input
+        pass
 
-    text = text.strip()
+    # Return raw with error info
+    return Report(raw_output=text, parse_error=str(error))
+
+
+def _to_report(data: Any, text: str) -> Report:
+    """Convert loosely-shaped parsed JSON into a Report, keeping every usable field."""
+    if not isinstance(data, dict):
+        return Report(raw_output=text, parse_error="Expected a JSON object")
+
+    # null means "not provided": fall back to the field default
+    data = {k: v for k, v in data.items() if v is not None and k not in _DIAGNOSTIC_KEYS}
+
+    for field in _LIST_FIELDS + ("actionable_recommendations", "key_themes"):
+        if field in data:
+            data[field] = _str_list(data[field])
+    if "executive_summary" in data and not isinstance(data["executive_summary"], str):
+        data["executive_summary"] = str(data["executive_summary"])
+
+    quotes = data.get("quotes")
+    if isinstance(quotes, dict):
+        quotes = {k: v for k, v in quotes.items() if v is not None}
+        for key in ("wow_effect", "typical_positive"):
+            if key in quotes and not isinstance(quotes[key], str):
+                quotes[key] = str(quotes[key])
+        if "typical_negatives" in quotes:
+            quotes["typical_negatives"] = _str_list(quotes["typical_negatives"])
+        data["quotes"] = quotes
+    elif quotes is not None:
+        del data["quotes"]
+
+    # Drop only the fields that still don't fit the schema
+    while True:
+        try:
+            return msgspec.convert(data, Report, strict=False)
+        except msgspec.ValidationError as e:
+            match = _ERROR_FIELD_RE.search(str(e))
+            if not match or match.group(1) not in data:
+                return Report(raw_output=text, parse_error=str(e))
+            del data[match.group(1)]
+
+
+def _str_list(value: Any) -> List[str]:
+    """Models sometimes return a single value or non-string items where the schema expects strings."""
+    if isinstance(value, list):
+        return [item if isinstance(item, str) else str(item) for item in value if item is not None]
+    return [value if isinstance(value, str) else str(value)]
 
-    # Count braces/brackets
-    open_braces = text.count('{')
-    close_braces = text.count('}')
-    open_brackets = text.count('[')
-    close_brackets = text.count(']')
-
-    # If unbalanced, try to close
-    if open_braces > close_braces or open_brackets > close_brackets:
-        # Check if we're in middle of a string
-        in_string = False
-        escape_next = False
-        last_good_pos = 0
-
-        for i, char in enumerate(text):
-            if escape_next:
-                escape_next = False
-                continue
-            if char == '\\':
-                escape_next = True
-                continue
-            if char == '"':
-                in_string = not in_string
-            if not in_string and char in ',]}':
-                last_good_pos = i + 1
-
-        # Truncate at last good position if needed
-        if in_string and last_good_pos > 0:
-            text = text[:last_good_pos]
-
-        # Re-count after potential truncation
-        open_braces = text.count('{')
-        close_braces = text.count('}')
-        open_brackets = text.count('[')
-        close_brackets = text.count(']')
-
-        # Add missing closures
-        missing_brackets = ']' * (open_brackets - close_brackets)
-        missing_braces = '}' * (open_braces - close_braces)
-
-        return text.rstrip(',') + missing_brackets + missing_braces
-
-    return None
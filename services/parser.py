@@ -1,60 +1,81 @@
+import codecs
 import io
-from typing import List, Dict
+from typing import BinaryIO, List, Dict, Union
 
 import pandas as pd
+from charset_normalizer import from_bytes
 
+_ENCODING_SAMPLE_SIZE = 64 * 1024
+_LEGACY_ENCODINGS = ['cp1251', 'cp1252', 'latin_1']
 
-def parse_reviews_file(filename: str, content: bytes) -> List[Dict]:
-    """Parse reviews from uploaded file (CSV, Excel, or TXT)."""
+REVIEW_COLUMNS = ('review', 'text', 'comment', 'отзыв', 'комментарий', 'текст')
+
+
+def parse_reviews_file(filename: str, content: Union[bytes, BinaryIO]) -> List[Dict]:
+    """Parse reviews from uploaded file (CSV, Excel, or TXT).
+
+    `content` may be raw bytes or a seekable binary file object (e.g. an
+    upload's spooled temp file), which is read in place without an extra copy.
+    """
     name = (filename or "").lower()
+    stream = io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
 
     if name.endswith(".csv"):
-        return _parse_csv(content)
+        return _parse_csv(stream)
 
     if name.endswith(".xlsx") or name.endswith(".xls"):
-        df = pd.read_excel(io.BytesIO(content))
+        df = pd.read_excel(stream, engine="calamine")
         return _df_to_reviews(df)
 
     if name.endswith(".txt"):
-        text = _decode_text(content)
+        text = _decode_text(stream.read())
         lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
         return [{"review_text": ln} for ln in lines]
 
     raise ValueError("Неподдерживаемый формат файла. Используйте CSV, XLSX или TXT.")
 
 
-def _decode_text(content: bytes) -> str:
-    """Try multiple encodings to decode text."""
-    encodings = ['utf-8', 'cp1251', 'cp1252', 'latin-1', 'iso-8859-1']
+def _detect_encoding(content: bytes) -> str:
+    """Detect text encoding: strict UTF-8 first, then the best legacy encoding."""
+    try:
+        # Incremental decoder tolerates a multi-byte char cut off at the end of a sample
+        codecs.getincrementaldecoder('utf-8')().decode(content, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    best = from_bytes(content, cp_isolation=_LEGACY_ENCODINGS).best()
+    return best.encoding if best and best.encoding else _LEGACY_ENCODINGS[0]
 
-    for encoding in encodings:
-        try:
-            return content.decode(encoding)
-        except (UnicodeDecodeError, LookupError):
-            continue
 
-    # Last resort: ignore errors
-    return content.decode('utf-8', errors='ignore')
+def _decode_text(content: bytes) -> str:
+    """Decode text using the detected encoding."""
+    try:
+        return content.decode(_detect_encoding(content))
+    except (UnicodeDecodeError, LookupError):
+        # Last resort: ignore errors
+        return content.decode('utf-8', errors='ignore')
 
 
-def _parse_csv(content: bytes) -> List[Dict]:
+def _parse_csv(stream: BinaryIO) -> List[Dict]:
     """Parse CSV with automatic encoding detection."""
-    encodings = ['utf-8', 'cp1251', 'cp1252', 'latin-1', 'iso-8859-1']
+    # Detect on a leading sample so the whole file is never held as bytes
+    start = stream.tell()
+    detected = _detect_encoding(stream.read(_ENCODING_SAMPLE_SIZE))
 
-    for encoding in encodings:
+    # The sample may be plain ASCII while later rows are not: retry the full stream
+    # with the usual Cyrillic encoding before giving up
+    for encoding in dict.fromkeys([detected, 'utf-8', _LEGACY_ENCODINGS[0]]):
         try:
-            df = pd.read_csv(io.BytesIO(content), encoding=encoding)
-            # Verify we got readable data by checking first row
-            if len(df) > 0:
-                first_val = str(df.iloc[0, 0])
-                # Check if it looks like garbled text
-                if '�' not in first_val:
-                    return _df_to_reviews(df)
-        except (UnicodeDecodeError, pd.errors.ParserError):
+            stream.seek(start)
+            df = pd.read_csv(stream, encoding=encoding)
+            return _df_to_reviews(df)
+        except (UnicodeDecodeError, LookupError, pd.errors.ParserError):
             continue
 
     # Fallback: try with errors='replace'
-    df = pd.read_csv(io.BytesIO(content), encoding='utf-8', encoding_errors='replace')
+    stream.seek(start)
+    df = pd.read_csv(stream, encoding='utf-8', encoding_errors='replace')
     return _df_to_reviews(df)
 
 
@@ -63,23 +84,11 @@ def _df_to_reviews(df: pd.DataFrame) -> List[Dict]:
     if df.empty:
         return []
 
-    cols_lower = [c.lower() for c in df.columns]
-
-    # Try to find review/text column
-    review_col = None
-    for target in ['review', 'text', 'comment', 'отзыв', 'комментарий', 'текст']:
-        if target in cols_lower:
-            review_col = df.columns[cols_lower.index(target)]
-            break
-
-    # Fallback to first column
-    if review_col is None:
-        review_col = df.columns[0]
+    # Find review/text column, falling back to the first column
+    col_map = {str(c).lower(): c for c in reversed(df.columns)}
+    review_col = next((col_map[t] for t in REVIEW_COLUMNS if t in col_map), df.columns[0])
 
-    reviews = []
-    for _, row in df.iterrows():
-        text = str(row[review_col]).strip()
-        if text and text.lower() not in ['nan', 'none', '']:
-            reviews.append({"review_text": text})
+    texts = df[review_col].astype(str).str.strip()
+    mask = texts.str.len().gt(0) & ~texts.str.lower().isin(['nan', 'none'])
 
-    return reviews
+    return [{"review_text": text} for text in texts[mask].tolist()]
@@ -36,3 +36,14 @@ JSON_SCHEMA_INSTRUCTION = """
 - Заверши JSON полностью — не обрезай
 - Не оборачивай в ```
 """
+
+NO_RISKS = "Критических проблем не выявлено"
+
+SUMMARY_REDUCE_PROMPT = """
+🔴 ОБЯЗАТЕЛЬНО: ВЕСЬ ОТВЕТ ДОЛЖЕН БЫТЬ НА РУССКОМ ЯЗЫКЕ! 🔴
+
+РОЛЬ: Ты — профессиональный аналитик качества сервиса в сфере HoReCa (отели и гостеприимство).
+
+ЦЕЛЬ: Ниже приведены частичные резюме, составленные по разным группам отзывов об одном отеле.
+Объедини их в одно итоговое резюме (executive_summary, 2-3 предложения), сохранив самые частые и важные выводы.
+"""
@@ -1,14 +1,20 @@
 import io
 from datetime import datetime
-from typing import Dict, List, Any
+from functools import lru_cache
+from typing import Dict, Any, NamedTuple
 
+from reportlab.lib.colors import HexColor
 from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, ListFlowable, ListItem
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfgen import canvas
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_LEFT, TA_JUSTIFY
+
+from services.schema import Report
+
+
+_MARGIN = 2*cm
 
 
 def _register_fonts():
@@ -43,193 +49,194 @@ def _register_fonts():
     return font_registered
 
 
-def _get_styles(font_registered: bool):
-    """Create styles with proper font."""
-    styles = getSampleStyleSheet()
-    font_name = 'CustomFont' if font_registered else 'Helvetica'
-
-    styles.add(ParagraphStyle(
-        name='RussianTitle',
-        fontName=font_name,
-        fontSize=16,
-        leading=20,
-        spaceAfter=12,
-        alignment=TA_LEFT,
-    ))
-
-    styles.add(ParagraphStyle(
-        name='RussianHeading',
-        fontName=font_name,
-        fontSize=12,
-        leading=14,
-        spaceAfter=6,
-        spaceBefore=12,
-        textColor='#2c5282',
-    ))
-
-    styles.add(ParagraphStyle(
-        name='RussianBody',
-        fontName=font_name,
-        fontSize=10,
-        leading=14,
-        spaceAfter=6,
-        alignment=TA_JUSTIFY,
-    ))
-
-    styles.add(ParagraphStyle(
-        name='RussianQuote',
-        fontName=font_name,
-        fontSize=10,
-        leading=14,
-        leftIndent=20,
-        spaceAfter=6,
-        textColor='#4a5568',
-        fontStyle='italic',
-    ))
-
-    styles.add(ParagraphStyle(
-        name='RussianBullet',
-        fontName=font_name,
-        fontSize=10,
-        leading=14,
-        leftIndent=15,
-        spaceAfter=4,
-    ))
-
-    return styles
-
-
-def build_pdf(report: Dict, title: str = "Отчет по анализу отзывов") -> bytes:
+# Register once per process instead of re-parsing the TTF on every report
+_FONT_REGISTERED = _register_fonts()
+
+
+_FONT_NAME = 'CustomFont' if _FONT_REGISTERED else 'Helvetica'
+
+
+class _TextStyle(NamedTuple):
+    font_size: float
+    leading: float
+    left_indent: float = 0
+    space_before: float = 0
+    space_after: float = 0
+    color: str = '#000000'
+
+
+@lru_cache(maxsize=1)
+def _get_styles() -> Dict[str, _TextStyle]:
+    """Create text styles for the report."""
+    return {
+        'RussianTitle': _TextStyle(font_size=16, leading=20, space_after=12),
+        'RussianHeading': _TextStyle(font_size=12, leading=14, space_before=12, space_after=6, color='#2c5282'),
+        'RussianBody': _TextStyle(font_size=10, leading=14, space_after=6),
+        'RussianQuote': _TextStyle(font_size=10, leading=14, left_indent=20, space_after=6, color='#4a5568'),
+        'RussianBullet': _TextStyle(font_size=10, leading=14, left_indent=15, space_after=4),
+    }
+
+
+class _PdfWriter:
+    """Draws wrapped text straight onto a canvas, tracking the y-cursor and page breaks."""
+
+    def __init__(self, buffer: io.BytesIO, title: str):
+        self.canvas = canvas.Canvas(buffer, pagesize=A4)
+        self.canvas.setTitle(title)
+        self.page_width, self.page_height = A4
+        self.y = self.page_height - _MARGIN
+
+    def space(self, height: float):
+        self.y -= height
+
+    def text(self, text: str, style: _TextStyle):
+        """Draw a paragraph, wrapping it to the page width."""
+        width = self.page_width - 2*_MARGIN - style.left_indent
+        lines = []
+        for para in str(text).split('\n'):
+            lines.extend(simpleSplit(para, _FONT_NAME, style.font_size, width) or [''])
+
+        self.y -= style.space_before
+        self._set_style(style)
+        for line in lines:
+            if self.y - style.leading < _MARGIN:
+                self.canvas.showPage()
+                self.y = self.page_height - _MARGIN
+                self._set_style(style)
+            self.y -= style.leading
+            self.canvas.drawString(_MARGIN + style.left_indent, self.y, line)
+        self.y -= style.space_after
+
+    def save(self):
+        self.canvas.save()
+
+    def _set_style(self, style: _TextStyle):
+        self.canvas.setFont(_FONT_NAME, style.font_size)
+        self.canvas.setFillColor(HexColor(style.color))
+
+
+def build_pdf(report: Report, title: str = "Отчет по анализу отзывов") -> bytes:
     """Build PDF report from analysis results."""
     buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        leftMargin=2*cm,
-        rightMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm
+    pdf = _PdfWriter(buffer, title)
+
+    styles = _get_styles()
+    H, B, BU, Q = (
+        styles['RussianHeading'],
+        styles['RussianBody'],
+        styles['RussianBullet'],
+        styles['RussianQuote'],
     )
 
-    font_registered = _register_fonts()
-    styles = _get_styles(font_registered)
-
-    story = []
-
     # Title
-    story.append(Paragraph(title, styles['RussianTitle']))
-    story.append(Paragraph(
-        f"Дата создания: {datetime.utcnow().strftime('%d.%m.%Y %H:%M')} UTC",
-        styles['RussianBody']
-    ))
-    story.append(Spacer(1, 12))
+    pdf.text(title, styles['RussianTitle'])
+    pdf.text(f"Дата создания: {datetime.utcnow().strftime('%d.%m.%Y %H:%M')} UTC", B)
+    pdf.space(12)
 
     # Executive Summary
     _add_section(
-        story, styles,
+        pdf, H, B,
         "📋 Краткое резюме",
-        report.get("executive_summary", "")
+        report.executive_summary
     )
 
     # Quotes section
-    quotes = report.get("quotes", {})
-    if quotes:
-        story.append(Paragraph("💬 Примеры отзывов", styles['RussianHeading']))
-        story.append(Spacer(1, 6))
+    quotes = report.quotes
+    if quotes.wow_effect or quotes.typical_positive or quotes.typical_negatives:
+        pdf.text("💬 Примеры отзывов", H)
+        pdf.space(6)
 
-        if quotes.get("wow_effect"):
-            story.append(Paragraph("⭐ Вау-эффект:", styles['RussianBody']))
-            story.append(Paragraph(f'"{quotes["wow_effect"]}"', styles['RussianQuote']))
+        if quotes.wow_effect:
+            pdf.text("⭐ Вау-эффект:", B)
+            pdf.text(f'"{quotes.wow_effect}"', Q)
 
-        if quotes.get("typical_positive"):
-            story.append(Paragraph("✅ Типичный позитив:", styles['RussianBody']))
-            story.append(Paragraph(f'"{quotes["typical_positive"]}"', styles['RussianQuote']))
+        if quotes.typical_positive:
+            pdf.text("✅ Типичный позитив:", B)
+            pdf.text(f'"{quotes.typical_positive}"', Q)
 
-        if quotes.get("typical_negatives"):
-            story.append(Paragraph("❌ Типичный негатив:", styles['RussianBody']))
-            for neg in quotes["typical_negatives"]:
-                story.append(Paragraph(f'"{neg}"', styles['RussianQuote']))
+        if quotes.typical_negatives:
+            pdf.text("❌ Типичный негатив:", B)
+            for neg in quotes.typical_negatives:
+                pdf.text(f'"{neg}"', Q)
 
-        story.append(Spacer(1, 12))
+        pdf.space(12)
 
     # Positives
     _add_list_section(
-        story, styles,
+        pdf, H, B, BU,
         "✅ Сильные стороны",
-        report.get("positives", [])
+        report.positives
     )
 
     # Negatives
     _add_list_section(
-        story, styles,
+        pdf, H, B, BU,
         "❌ Слабые стороны",
-        report.get("negatives", [])
+        report.negatives
     )
 
     # Risk Flags
     _add_list_section(
-        story, styles,
+        pdf, H, B, BU,
         "🚨 Красные флаги",
-        report.get("risk_flags", []),
+        report.risk_flags,
         is_critical=True
     )
 
     # Action Plan
     _add_list_section(
-        story, styles,
+        pdf, H, B, BU,
         "📌 План действий",
-        report.get("action_plan", report.get("actionable_recommendations", []))
+        report.action_plan or report.actionable_recommendations
     )
 
     # Best Practices
     _add_list_section(
-        story, styles,
+        pdf, H, B, BU,
         "💡 Системные улучшения",
-        report.get("best_practices", [])
+        report.best_practices
     )
 
     # Key themes (legacy support)
-    if "key_themes" in report:
+    if report.key_themes is not None:
         _add_list_section(
-            story, styles,
+            pdf, H, B, BU,
             "🔑 Ключевые темы",
-            report.get("key_themes", [])
+            report.key_themes
         )
 
     # Raw output fallback
-    if "raw_output" in report:
-        story.append(Paragraph("📄 Необработанный вывод модели", styles['RussianHeading']))
-        story.append(Spacer(1, 6))
-        raw_text = str(report["raw_output"])
+    if report.raw_output is not None:
+        pdf.text("📄 Необработанный вывод модели", H)
+        pdf.space(6)
+        raw_text = report.raw_output
         # Split long text into paragraphs
         for para in raw_text.split('\n'):
             if para.strip():
-                story.append(Paragraph(para, styles['RussianBody']))
-        story.append(Spacer(1, 12))
+                pdf.text(para, B)
+        pdf.space(12)
 
-    doc.build(story)
+    pdf.save()
     return buffer.getvalue()
 
 
-def _add_section(story: List, styles, header: str, text: str):
-    """Add a text section to the story."""
-    story.append(Paragraph(header, styles['RussianHeading']))
-    story.append(Spacer(1, 6))
-    if text:
-        story.append(Paragraph(str(text), styles['RussianBody']))
-    else:
-        story.append(Paragraph("—", styles['RussianBody']))
-    story.append(Spacer(1, 12))
+def _add_section(pdf: _PdfWriter, heading_style: _TextStyle, body_style: _TextStyle, header: str, text: str):
+    """Add a text section to the report."""
+    pdf.text(header, heading_style)
+    pdf.space(6)
+    pdf.text(str(text) if text else "—", body_style)
+    pdf.space(12)
 
 
-def _add_list_section(story: List, styles, header: str, items: Any, is_critical: bool = False):
-    """Add a list section to the story."""
-    story.append(Paragraph(header, styles['RussianHeading']))
-    story.append(Spacer(1, 6))
+def _add_list_section(pdf: _PdfWriter, heading_style: _TextStyle, body_style: _TextStyle,
+                      bullet_style: _TextStyle, header: str, items: Any, is_critical: bool = False):
+    """Add a list section to the report."""
+    pdf.text(header, heading_style)
+    pdf.space(6)
 
     if not items:
-        story.append(Paragraph("—", styles['RussianBody']))
-        story.append(Spacer(1, 12))
+        pdf.text("—", body_style)
+        pdf.space(12)
         return
 
     # Handle case where items is not a list
@@ -242,6 +249,6 @@ def _add_list_section(story: List, styles, header: str, items: Any, is_critical:
         bullet = "• "
         if is_critical and item != "Критических проблем не выявлено":
             bullet = "⚠️ "
-        story.append(Paragraph(f"{bullet}{str(item)}", styles['RussianBullet']))
+        pdf.text(f"{bullet}{str(item)}", bullet_style)
 
-    story.append(Spacer(1, 12))
+    pdf.space(12)
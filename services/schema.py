@@ -0,0 +1,36 @@
+from typing import List, Optional
+
+import msgspec
+
+
+class Quotes(msgspec.Struct):
+    wow_effect: str = ""
+    typical_positive: str = ""
+    typical_negatives: List[str] = []
+
+
+class Report(msgspec.Struct):
+    """Review analysis report, matching JSON_SCHEMA_INSTRUCTION."""
+    executive_summary: str = ""
+    quotes: Quotes = msgspec.field(default_factory=Quotes)
+    positives: List[str] = []
+    negatives: List[str] = []
+    risk_flags: List[str] = []
+    action_plan: List[str] = []
+    best_practices: List[str] = []
+
+    # Legacy fields from older prompts
+    actionable_recommendations: List[str] = []
+    key_themes: Optional[List[str]] = None
+
+    # Set when the model output could not be used as-is
+    raw_output: Optional[str] = None
+    parse_error: Optional[str] = None
+    error: Optional[str] = None
+    finish_reason: Optional[str] = None
+    warning: Optional[str] = msgspec.field(default=None, name="_warning")
+
+    @property
+    def failed(self) -> bool:
+        """True if the model output could not be parsed into a report."""
+        return self.raw_output is not None or self.error is not None
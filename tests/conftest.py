@@ -0,0 +1,57 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Must be set before services.cache is imported: the cache directory is opened at import
+os.environ.setdefault("LLM_CACHE_DIR", tempfile.mkdtemp(prefix="llm_cache_test_"))
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import httpx
+import orjson
+import pytest
+from tenacity import wait_none
+
+import services.cache as cache
+import services.llm_client as llm_client
+
+
+def gemini_response(report: dict, finish_reason: str = "STOP") -> httpx.Response:
+    body = {
+        "candidates": [{
+            "finishReason": finish_reason,
+            "content": {"parts": [{"text": orjson.dumps(report).decode()}]},
+        }]
+    }
+    return httpx.Response(200, content=orjson.dumps(body))
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Route LLM calls to a fake Gemini endpoint; set `handler` on the returned object."""
+    monkeypatch.setenv("LLM_PROVIDER", "gemini")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.delenv("LLM_SHARD_SIZE", raising=False)
+    monkeypatch.delenv("LLM_REDUCE_SUMMARY", raising=False)
+
+    class Fake:
+        calls = 0
+
+        def handler(self, request):
+            return gemini_response({"executive_summary": "ok"})
+
+    fake = Fake()
+
+    def transport(request):
+        fake.calls += 1
+        return fake.handler(request)
+
+    monkeypatch.setattr(
+        llm_client, "_new_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(transport)),
+    )
+    # No backoff sleeps in tests
+    monkeypatch.setattr(llm_client._post.retry, "wait", wait_none())
+    cache._cache.clear()
+    return fake
@@ -0,0 +1,67 @@
+import httpx
+from fastapi.testclient import TestClient
+
+import api.main
+from api.main import app
+
+
+def test_analyze_batch_returns_results_in_order_with_per_file_errors(gemini):
+    with TestClient(app) as client:
+        resp = client.post(
+            "/analyze/batch",
+            files=[
+                ("files", ("a.txt", "хорошо\nплохо\n".encode())),
+                ("files", ("b.doc", b"unsupported")),
+                ("files", ("c.txt", "чисто\n".encode())),
+            ],
+        )
+
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [r["filename"] for r in results] == ["a.txt", "b.doc", "c.txt"]
+    assert results[0]["report"]["executive_summary"] == "ok"
+    assert results[0]["analyzed_reviews"] == 2
+    assert "error" in results[1]
+    assert results[2]["total_reviews"] == 1
+    assert gemini.calls == 2
+
+
+def test_analyze_batch_reports_llm_failure_per_file(gemini):
+    gemini.handler = lambda request: httpx.Response(500)
+
+    with TestClient(app) as client:
+        resp = client.post("/analyze/batch", files=[("files", ("a.txt", "отзыв\n".encode()))])
+
+    result = resp.json()["results"][0]
+    assert result["error"].startswith("Ошибка анализа")
+    # Retried with backoff before giving up
+    assert gemini.calls == 4
+
+
+def test_cache_distinguishes_file_type(gemini):
+    content = "review\nхорошо\nплохо\n".encode()
+
+    with TestClient(app) as client:
+        as_csv = client.post("/analyze", files={"file": ("a.csv", content)}).json()
+        as_txt = client.post("/analyze", files={"file": ("a.txt", content)}).json()
+
+    assert as_csv["total_reviews"] == 2
+    assert as_txt["total_reviews"] == 3
+    assert gemini.calls == 2
+
+
+def test_failed_preload_is_reported_as_unavailable(monkeypatch):
+    def broken_preload():
+        raise ImportError("No module named 'pandas'")
+
+    monkeypatch.setattr(api.main, "_preload_services", broken_preload)
+
+    # Leaving the block runs shutdown, which must not re-raise the preload error
+    with TestClient(app) as client:
+        analyze = client.post("/analyze", files={"file": ("a.txt", "отзыв\n".encode())})
+        health = client.get("/health")
+
+    assert analyze.status_code == 503
+    assert "pandas" in analyze.json()["detail"]
+    assert health.status_code == 503
+    assert health.json()["ok"] is False
@@ -0,0 +1,171 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import services.llm_client as llm_client
+from services.prompt import NO_RISKS
+from services.schema import Quotes, Report
+from tests.conftest import gemini_response
+
+
+def _post(url="https://llm.test/v1"):
+    return llm_client._post(url, {"q": 1}, {"Content-Type": "application/json"}, timeout=5)
+
+
+def test_post_retries_rate_limit_then_succeeds(gemini):
+    statuses = iter([429, 503, 200])
+    gemini.handler = lambda request: httpx.Response(next(statuses))
+
+    resp = asyncio.run(_post())
+
+    assert resp.status_code == 200
+    assert gemini.calls == 3
+
+
+def test_post_gives_up_after_four_attempts(gemini):
+    gemini.handler = lambda request: httpx.Response(503)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(_post())
+    assert gemini.calls == 4
+
+
+def test_post_does_not_retry_client_errors(gemini):
+    gemini.handler = lambda request: httpx.Response(400)
+
+    resp = asyncio.run(_post())
+
+    assert resp.status_code == 400
+    assert gemini.calls == 1
+
+
+def test_post_respects_concurrency_limit(gemini, monkeypatch):
+    monkeypatch.setenv("LLM_CONCURRENCY", "2")
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return httpx.Response(200)
+
+    monkeypatch.setattr(
+        llm_client, "_new_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+    async def run():
+        await asyncio.gather(*[_post() for _ in range(6)])
+        await llm_client.close_client()
+
+    asyncio.run(run())
+    assert peak == 2
+
+
+def test_concurrent_event_loops_do_not_share_client_or_semaphore(gemini, monkeypatch):
+    monkeypatch.setenv("LLM_CONCURRENCY", "1")
+    errors = []
+
+    async def session():
+        try:
+            await asyncio.gather(*[_post() for _ in range(3)])
+        finally:
+            await llm_client.close_client()
+
+    def run():
+        try:
+            asyncio.run(session())
+        except Exception as e:  # pragma: no cover - reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert gemini.calls == 12
+
+
+def _shard_report(i):
+    return Report(
+        executive_summary=f"S{i}",
+        positives=[f"p{i}_{j}" for j in range(5)],
+        risk_flags=[f"r{i}_{j}" for j in range(4)] + ([NO_RISKS] if i == 0 else []),
+        actionable_recommendations=[f"a{i}"],
+        key_themes=[f"k{i}"] if i % 2 else None,
+        quotes=Quotes(typical_negatives=[f"n{i}"]),
+    )
+
+
+def test_merge_reports_keeps_items_from_every_shard():
+    merged = llm_client._merge_reports([_shard_report(i) for i in range(5)])
+
+    assert merged.positives[:5] == ["p0_0", "p1_0", "p2_0", "p3_0", "p4_0"]
+    assert len(merged.positives) == llm_client._MAX_LIST_ITEMS
+    # Risk flags are never truncated and the placeholder is dropped when real flags exist
+    assert len(merged.risk_flags) == 20
+    assert NO_RISKS not in merged.risk_flags
+    assert merged.actionable_recommendations == ["a0", "a1", "a2", "a3", "a4"]
+    assert merged.key_themes == ["k1", "k3"]
+    assert merged.quotes.typical_negatives == ["n0", "n1", "n2"]
+
+
+def test_merge_reports_ranks_repeated_items_first_and_warns_on_failed_shards():
+    results = [
+        Report(positives=["a", "shared"]),
+        Report(positives=["b", "shared"]),
+        Report(raw_output="garbage", parse_error="bad"),
+    ]
+
+    merged = llm_client._merge_reports(results)
+
+    assert merged.positives[0] == "shared"
+    assert merged.risk_flags == [NO_RISKS]
+    assert "1 of 3" in merged.warning
+
+
+def test_sharded_analysis_reduces_summary_by_default(gemini, monkeypatch):
+    monkeypatch.setenv("LLM_SHARD_SIZE", "2")
+    gemini.handler = lambda request: gemini_response(
+        {"executive_summary": "combined" if b"SHARD" not in request.content else "part"}
+    )
+
+    async def run():
+        try:
+            return await llm_client.analyze_reviews_with_llm(
+                [{"review_text": f"SHARD review {i}"} for i in range(5)]
+            )
+        finally:
+            await llm_client.close_client()
+
+    report = asyncio.run(run())
+
+    assert gemini.calls == 4  # 3 shards + 1 reduce call
+    assert report.executive_summary == "combined"
+    assert report.warning is None
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"executive_summary": "ok", "raw_output": "x", "error": "e", "_warning": "w"}',
+        # Off-type field: goes through the lenient conversion
+        '{"executive_summary": "ok", "positives": "one", "raw_output": "x", "_warning": "w"}',
+        # Truncated: goes through the partial parser
+        '{"executive_summary": "ok", "parse_error": "x", "_warning": "w", "positives": ["a',
+    ],
+)
+def test_safe_json_ignores_diagnostic_keys_from_the_model(text):
+    report = llm_client._safe_json(text)
+
+    assert report.executive_summary == "ok"
+    assert not report.failed
+    assert report.parse_error is None
+    assert report.warning is None